@@ -3,6 +3,8 @@ class Variable():
     ACROSS = "across"
     DOWN = "down"
 
+    __slots__ = ("i", "j", "direction", "length", "cells", "_hash")
+
     def __init__(self, i, j, direction, length):
         """Create a new variable with starting point, direction, and length."""
         self.i = i
@@ -15,9 +17,10 @@ class Variable():
                 (self.i + (k if self.direction == Variable.DOWN else 0),
                  self.j + (k if self.direction == Variable.ACROSS else 0))
             )
+        self._hash = hash((self.i, self.j, self.direction, self.length))
 
     def __hash__(self):
-        return hash((self.i, self.j, self.direction, self.length))
+        return self._hash
 
     def __eq__(self, other):
         return (
@@ -1,71 +1,122 @@
 import sys
 
+from collections import defaultdict, deque
+
 from crossword import *
 
 
 class CrosswordCreator():
 
+    # Lazily loaded PIL font shared by all save() calls
+    _font = None
+
     def __init__(self, crossword):
         """
         Create new CSP crossword generate.
         """
         self.crossword = crossword
+        by_length = defaultdict(set)
+        for word in self.crossword.words:
+            by_length[len(word)].add(word)
         self.domains = {
-            var: self.crossword.words.copy()
+            var: set(by_length[var.length])
+            for var in self.crossword.variables
+        }
+        self.neighbors = {
+            var: frozenset(self.crossword.neighbors(var))
+            for var in self.crossword.variables
+        }
+        self.overlap = {
+            var: {
+                neighbor: self.crossword.overlaps[var, neighbor]
+                for neighbor in self.neighbors[var]
+            }
             for var in self.crossword.variables
         }
+        self.degree = {
+            var: len(self.neighbors[var])
+            for var in self.crossword.variables
+        }
+        self.arc_table = [
+            (x, y, overlap[0], overlap[1])
+            for (x, y), overlap in self.crossword.overlaps.items()
+            if overlap is not None
+        ]
+        self.arc_index = {
+            (x, y): k for k, (x, y, _, _) in enumerate(self.arc_table)
+        }
+        self.arcs_into = {var: [] for var in self.crossword.variables}
+        for k, (x, y, _, _) in enumerate(self.arc_table):
+            self.arcs_into[y].append(k)
+        self.trail = []
+        self.n_vars = len(self.crossword.variables)
+        self.build_letter_index()
 
     def letter_grid(self, assignment):
         """
-        Return 2D array representing a given assignment.
+        Return a flat bytearray of size height * width representing a
+        given assignment. Empty cells hold 0; filled cells hold the
+        letter's byte value. Cell (i, j) is at index i * width + j.
         """
-        letters = [
-            [None for _ in range(self.crossword.width)]
-            for _ in range(self.crossword.height)
-        ]
+        width = self.crossword.width
+        letters = bytearray(self.crossword.height * width)
         for variable, word in assignment.items():
             direction = variable.direction
             for k in range(len(word)):
                 i = variable.i + (k if direction == Variable.DOWN else 0)
                 j = variable.j + (k if direction == Variable.ACROSS else 0)
-                letters[i][j] = word[k]
+                letters[i * width + j] = ord(word[k])
         return letters
 
-    def print(self, assignment):
+    def print(self, assignment, letters=None):
         """
         Print crossword assignment to the terminal.
+        A precomputed `letter_grid` result may be passed as `letters` to
+        avoid rebuilding the grid.
         """
-        letters = self.letter_grid(assignment)
+        if letters is None:
+            letters = self.letter_grid(assignment)
+        width = self.crossword.width
         for i in range(self.crossword.height):
-            for j in range(self.crossword.width):
+            for j in range(width):
                 if self.crossword.structure[i][j]:
-                    print(letters[i][j] or " ", end="")
+                    cell = letters[i * width + j]
+                    print(chr(cell) if cell else " ", end="")
                 else:
                     print("█", end="")
             print()
 
-    def save(self, assignment, filename):
+    def save(self, assignment, filename, letters=None):
         """
         Save crossword assignment to an image file.
+        A precomputed `letter_grid` result may be passed as `letters` to
+        avoid rebuilding the grid.
         """
         from PIL import Image, ImageDraw, ImageFont
         cell_size = 100
         cell_border = 2
         interior_size = cell_size - 2 * cell_border
-        letters = self.letter_grid(assignment)
+        if letters is None:
+            letters = self.letter_grid(assignment)
+        width = self.crossword.width
 
         # Create a blank canvas
         img = Image.new(
             "RGBA",
-            (self.crossword.width * cell_size,
+            (width * cell_size,
              self.crossword.height * cell_size),
             "black"
         )
-        font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", 80)
+        font = CrosswordCreator._font
+        if font is None:
+            font = CrosswordCreator._font = ImageFont.truetype(
+                "assets/fonts/OpenSans-Regular.ttf", 80
+            )
         draw = ImageDraw.Draw(img)
+        sizes = dict()
 
         for i in range(self.crossword.height):
-            for j in range(self.crossword.width):
+            for j in range(width):
 
                 rect = [
                     (j * cell_size + cell_border,
@@ -75,12 +126,18 @@ class CrosswordCreator():
                 ]
                 if self.crossword.structure[i][j]:
                     draw.rectangle(rect, fill="white")
-                    if letters[i][j]:
-                        _, _, w, h = draw.textbbox((0, 0), letters[i][j], font=font)
+                    cell = letters[i * width + j]
+                    if cell:
+                        letter = chr(cell)
+                        if letter not in sizes:
+                            sizes[letter] = draw.textbbox(
+                                (0, 0), letter, font=font
+                            )[2:]
+                        (w, h) = sizes[letter]
                         draw.text(
                             (rect[0][0] + ((interior_size - w) / 2),
                              rect[0][1] + ((interior_size - h) / 2) - 10),
-                            letters[i][j], fill="black", font=font
+                            letter, fill="black", font=font
                         )
 
         img.save(filename)
@@ -94,12 +151,29 @@ class CrosswordCreator():
         return self.backtrack(dict())
 
     def enforce_node_consistency(self):
-        for key in self.domains:
-            domainCopy = self.domains[key].copy()
-            for word in domainCopy:
-                if len(word) != key.length:
-                    self.domains[key].remove(word)
+        """
+        Domains are already restricted to words of the matching length
+        when the creator is constructed, so there is nothing to remove
+        here; the method remains as part of the solve pipeline.
+        """
 
+    def build_letter_index(self):
+        """
+        Build `self.letter_index`, mapping each variable to a list (one
+        entry per letter position) of dicts `letter -> set of words` in
+        that variable's domain with that letter at that position.
+        Lets `revise` test support with one O(1) lookup instead of
+        scanning the whole neighboring domain.
+        """
+        self.letter_index = {
+            var: [defaultdict(set) for _ in range(var.length)]
+            for var in self.crossword.variables
+        }
+        for var, words in self.domains.items():
+            index = self.letter_index[var]
+            for word in words:
+                for pos, letter in enumerate(word):
+                    index[pos][letter].add(word)
 
     def revise(self, x, y):
         """
@@ -110,20 +184,33 @@ class CrosswordCreator():
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        overlap = self.crossword.overlaps[x,y]
+        overlap = self.overlap[x].get(y)
         if not overlap:
             return False
-        revisone_made = False 
-        x_domains = self.domains[x].copy()
-        for val_x in x_domains:
-            count = 0
-            for val_y in self.domains[y]:
-                if val_y[overlap[1]] != val_x[overlap[0]]:
-                    count += 1
-                if count == len(self.domains[y]):
-                    self.domains[x].remove(val_x)
-                    revisone_made = True
-        return revisone_made
+        return self.revise_arc(x, y, overlap[0], overlap[1])
+
+    def revise_arc(self, x, y, pos_x, pos_y):
+        """
+        Revise the arc from `x` to `y` whose overlap positions are
+        already known, as recorded in `self.arc_table`.
+        """
+        letters_x = self.letter_index[x][pos_x]
+        letters_y = self.letter_index[y][pos_y]
+        dead_letters = letters_x.keys() - letters_y.keys()
+        if not dead_letters:
+            return False
+        dead_words = set()
+        for letter in dead_letters:
+            dead_words |= letters_x[letter]
+        self.domains[x] -= dead_words
+        index_x = self.letter_index[x]
+        for word in dead_words:
+            for pos, ch in enumerate(word):
+                bucket = index_x[pos][ch]
+                bucket.discard(word)
+                if not bucket:
+                    del index_x[pos][ch]
+        return True
 
 
 
@@ -137,21 +224,33 @@ class CrosswordCreator():
         return False if one or more domains end up empty.
         """
         if not arcs:
-            arcs = []
-            for variable in self.crossword.variables:
-                neighbors = self.crossword.neighbors(variable)
-                for neighbor in neighbors:   
-                    if (variable, neighbor) not in arcs:
-                        arcs.append((variable,neighbor))
-        while len(arcs) != 0:
-            (x,y) = arcs.pop(0)
-            if self.revise(x,y):
-                if(len(self.domains[x]) == 0):
+            queue = deque(range(len(self.arc_table)))
+            queued = set(queue)
+        else:
+            queue = deque()
+            queued = set()
+            for arc in arcs:
+                k = self.arc_index.get(arc)
+                if k is not None and k not in queued:
+                    queued.add(k)
+                    queue.append(k)
+        arc_table = self.arc_table
+        arcs_into = self.arcs_into
+        revise_arc = self.revise_arc
+        domains = self.domains
+        popleft = queue.popleft
+        append = queue.append
+        while queue:
+            k = popleft()
+            queued.discard(k)
+            (x, y, pos_x, pos_y) = arc_table[k]
+            if revise_arc(x, y, pos_x, pos_y):
+                if not domains[x]:
                     return False
-                x_neighbors = self.crossword.neighbors(x)
-                x_neighbors.remove(y)
-                for z in x_neighbors:
-                    arcs.append((z,x))
+                for k2 in arcs_into[x]:
+                    if k2 not in queued and arc_table[k2][0] != y:
+                        queued.add(k2)
+                        append(k2)
         return True
 
 
@@ -160,35 +259,93 @@ class CrosswordCreator():
         Return True if `assignment` is complete (i.e., assigns a value to each
         crossword variable); return False otherwise.
         """
-        for key in assignment:
-            if key not in assignment:
-                return False
-            if not assignment[key]:
-                return False
-        if len(assignment) != len(self.crossword.variables):
-             return False
-        return True
+        return len(assignment) == self.n_vars
+
     def consistent(self, assignment):
         """
         Return True if `assignment` is consistent (i.e., words fit in crossword
         puzzle without conflicting characters); return False otherwise.
         """
-        word = None
-        for key in assignment:
-            if key.length != len(assignment[key]):
-                return False           
-            if assignment[key] != word:
-                word = assignment[key]
-            elif assignment[key] == word:
+        if len(set(assignment.values())) != len(assignment):
+            return False
+        for key, word in assignment.items():
+            if key.length != len(word):
                 return False
+            for neighbor in self.neighbors[key]:
+                if neighbor not in assignment:
+                    continue
+                (i, j) = self.overlap[key][neighbor]
+                if word[i] != assignment[neighbor][j]:
+                    return False
+        return True
 
-            neighbors = self.crossword.neighbors(key)
-            for neighbor in neighbors:
-                overlap = self.crossword.overlaps[key,neighbor]
-                if overlap:
-                    if assignment[key][overlap[0]] != self.domains[neighbor].copy().pop()[overlap[1]]:
-                        return False
-            
+    def consistent_assign(self, assignment, var):
+        """
+        Return True if the value just assigned to `var` keeps `assignment`
+        consistent. Only `var` needs checking: every other variable was
+        already consistent when it was assigned.
+        """
+        value = assignment[var]
+        if len(value) != var.length:
+            return False
+        for key, word in assignment.items():
+            if key != var and word == value:
+                return False
+        for neighbor in self.neighbors[var]:
+            if neighbor not in assignment:
+                continue
+            (i, j) = self.overlap[var][neighbor]
+            if value[i] != assignment[neighbor][j]:
+                return False
+        return True
+
+    def prune_word(self, var, word):
+        """
+        Remove `word` from the domain of `var` during search, keeping the
+        letter index in sync and recording the removal on the trail so it
+        can be undone when backtracking.
+        """
+        self.domains[var].discard(word)
+        index = self.letter_index[var]
+        for pos, letter in enumerate(word):
+            bucket = index[pos][letter]
+            bucket.discard(word)
+            if not bucket:
+                del index[pos][letter]
+        self.trail.append((var, word))
+
+    def restore_trail(self, marker):
+        """
+        Undo every pruning recorded on the trail after `marker`, putting
+        the removed words back into their domains and the letter index.
+        """
+        while len(self.trail) > marker:
+            (var, word) = self.trail.pop()
+            self.domains[var].add(word)
+            index = self.letter_index[var]
+            for pos, letter in enumerate(word):
+                index[pos][letter].add(word)
+
+    def forward_check(self, assignment, var, value):
+        """
+        Prune the domains of `var`'s unassigned neighbors down to words
+        compatible with assigning `value` to `var`, recording removals on
+        the trail. Return False if some neighbor's domain is emptied (the
+        caller restores the trail); return True otherwise.
+        """
+        for neighbor in self.neighbors[var]:
+            if neighbor in assignment:
+                continue
+            (i, j) = self.overlap[var][neighbor]
+            letter = value[i]
+            index_n = self.letter_index[neighbor][j]
+            for other in list(index_n):
+                if other == letter:
+                    continue
+                for word in list(index_n[other]):
+                    self.prune_word(neighbor, word)
+            if not self.domains[neighbor]:
+                return False
         return True
 
     def order_domain_values(self, var, assignment):
@@ -198,20 +355,20 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
-        assign_values = dict()
-
-        neighbors = self.crossword.neighbors(var)
-        for value in self.domains[var]:
-            assign_values[value] = 0
-            for neighbor in neighbors:
-                if neighbor in assignment:
-                    continue                
-                overlap = self.crossword.overlaps[var, neighbor]
-                for neighbor_value in self.domains[neighbor]:
-                    if value[overlap[0]] == neighbor_value[overlap[1]]:
-                        assign_values[value] += 1
-        sorted_values = sorted(assign_values, key=assign_values.get)
-        return list(sorted_values)
+        if len(self.domains[var]) <= 1:
+            return list(self.domains[var])
+        assign_values = dict.fromkeys(self.domains[var], 0)
+        for neighbor in self.neighbors[var]:
+            if neighbor in assignment:
+                continue
+            (pos_v, pos_n) = self.overlap[var][neighbor]
+            index_n = self.letter_index[neighbor][pos_n]
+            for letter, words in self.letter_index[var][pos_v].items():
+                support = len(index_n.get(letter, ()))
+                if support:
+                    for word in words:
+                        assign_values[word] += support
+        return sorted(assign_values, key=assign_values.get)
 
     def select_unassigned_variable(self, assignment):
         """
@@ -221,24 +378,14 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        # selected_var = None
-        # for var in self.crossword.variables:
-        #     if var in assignment:
-        #         continue
-        #     if not selected_var:
-        #         selected_var = var
-        #     if len(self.domains[selected_var]) > len(self.domains[var]):
-        #         selected_var = var
-        #     if len(self.domains[selected_var]) == len(self.domains[var]):
-        #         selected_var_degree = len(self.crossword.neighbors(selected_var))
-        #         var_degree = len(self.crossword.neighbors(var))
-        #         if var_degree > selected_var_degree:
-        #             selected_var = var
-        # return selected_var
-
-        for var in self.crossword.variables:
-            if var not in assignment:
-                return var
+        unassigned = [
+            var for var in self.crossword.variables
+            if var not in assignment
+        ]
+        return min(
+            unassigned,
+            key=lambda var: (len(self.domains[var]), -self.degree[var])
+        )
 
 
     def backtrack(self, assignment):
@@ -253,15 +400,36 @@ class CrosswordCreator():
         if self.assignment_complete(assignment):
             return assignment
         var = self.select_unassigned_variable(assignment)
-        for value in self.order_domain_values(var, assignment):  
-            temp_dic = assignment.copy()
-            temp_dic[var] = value
-            if self.consistent(temp_dic):
-                assignment[var] = value
-                result = self.backtrack(assignment)
-                if result:
-                    return result
+        stack = [[var, iter(self.order_domain_values(var, assignment)), None]]
+        while stack:
+            frame = stack[-1]
+            (var, values, marker) = frame
+            if marker is not None:
+                # Undo the pruning done for the previous value of `var`
+                # before trying the next one.
+                self.restore_trail(marker)
+                frame[2] = None
+            value = next(values, None)
+            if value is None:
+                stack.pop()
+                assignment.pop(var, None)
+                continue
+            assignment[var] = value
+            if not self.consistent_assign(assignment, var):
+                del assignment[var]
+                continue
+            if self.assignment_complete(assignment):
+                return assignment
+            marker = len(self.trail)
+            if not self.forward_check(assignment, var, value):
+                self.restore_trail(marker)
                 del assignment[var]
+                continue
+            frame[2] = marker
+            next_var = self.select_unassigned_variable(assignment)
+            stack.append(
+                [next_var, iter(self.order_domain_values(next_var, assignment)), None]
+            )
         return None
 
 
@@ -286,9 +454,10 @@ def main():
     if assignment is None:
         print("No solution.")
     else:
-        creator.print(assignment)
+        letters = creator.letter_grid(assignment)
+        creator.print(assignment, letters)
         if output:
-            creator.save(assignment, output)
+            creator.save(assignment, output, letters)
 
 
 if __name__ == "__main__":